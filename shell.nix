@@ -9,6 +9,8 @@ pkgs.mkShell {
   ]) ++ (with pkgs.python39Packages; [
     aiohttp
     av
+    orjson
+    uvloop
     virtualenv
   ]);
 }
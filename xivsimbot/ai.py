@@ -12,13 +12,23 @@ TICK_SPEED = 0.05  # seconds
 
 def xcircle(r, a): return round(r * math.cos(a))
 def ycircle(r, a): return round(r * math.sin(a))
+def scale(loc, k): return loc[0] * k, loc[1] * k
 
 
 def norm(vx, vy):
-    dist = math.sqrt(vx**2 + vy**2)
+    dist = math.hypot(vx, vy)
     return vx / dist, vy / dist
 
 
+def move_step(ax, ay, bx, by, dx, dy, dist):
+    '''Moves from (ax, ay) by dist along unit vector (dx, dy), without
+    overshooting the target (bx, by). Returns (x, y, still_moving).'''
+    if math.hypot(bx - ax, by - ay) >= dist:
+        return ax + dx * dist, ay + dy * dist, True
+    else:
+        return bx, by, False
+
+
 class BaseAiStrategy:
     def __init__(self, gclient, state, pid):
         self.gclient = gclient
@@ -55,13 +65,13 @@ class BaseAiStrategy:
 
     def is_ability_casting(self, name):
         self.state.gc_abilities()
-        for abi in self.state.abilities.values():
-            if abi.name == name and abi.cast_deadline > self.state.time():
-                return True
-        return False
+        t = self.state.time()
+        return any(abi.cast_deadline > t
+                   for abi in self.state.abilities_by_name.get(name, ()))
 
     def face(self, angle):
         self.me.angle = angle
+        self.me.dirty.set()
 
     def chat(self, msg):
         self.gclient.send('chat', {'u': self.me.name, 'm': msg})
@@ -76,70 +86,86 @@ class BaseAiStrategy:
         dx, dy = norm(dx, dy)
         angle = math.atan2(dy, dx)
 
-        t2 = self.state.time()
+        # Hoist method lookups out of the loop.
+        time_, tick = self.state.time, self.next_tick
+        update_player = self.state.update_player
+
+        t2 = time_()
         while ax != bx or ay != by:
-            await self.next_tick()
+            await tick()
             t1 = t2
-            t2 = self.state.time()
-
-            dt = t2 - t1
-            dist = MOVE_SPEED * dt
-
-            rx, ry = (bx - ax), (by - ay)
-            rdist = math.sqrt(rx**2 + ry**2)
+            t2 = time_()
 
-            if rdist >= dist:
-                ax, ay = ax + dx * dist, ay + dy * dist
-                moving = True
-            else:
-                ax, ay = bx, by
-                moving = False
-
-            self.state.update_player(self.pid, ax, ay, angle, moving)
+            dist = MOVE_SPEED * (t2 - t1)
+            ax, ay, moving = move_step(ax, ay, bx, by, dx, dy, dist)
+            update_player(self.pid, ax, ay, angle, moving)
 
     async def until_enemy_spawn(self, name):
-        while True:
-            for e in self.state.enemies.values():
-                if e.name == name:
-                    await self.until_delay(random.uniform(100, 300)/1000)
-                    return e.id
-            await self.next_tick()
+        evt = self.state.enemy_event(name)
+        while not self.state.enemies_by_name.get(name):
+            evt.clear()
+            await evt.wait()
+        eid = self.state.enemies_by_name[name][0].id
+        await self.until_delay(random.uniform(100, 300)/1000)
+        return eid
 
     async def until_buff_distributed(self, p, buffs):
-        while True:
-            for buff in p.buffs:
-                if buff in buffs:
-                    await self.until_delay(random.uniform(100, 300)/1000)
-                    return
-            await self.next_tick()
+        while buffs.isdisjoint(p.buffs):
+            p.buff_changed.clear()
+            await p.buff_changed.wait()
+        await self.until_delay(random.uniform(100, 300)/1000)
 
     async def until_buff_gone(self, p, buff):
-        while True:
-            if buff not in p.buffs:
-                await self.until_delay(random.uniform(50, 150)/1000)
-                return
-            await self.next_tick()
+        while buff in p.buffs:
+            p.buff_changed.clear()
+            await p.buff_changed.wait()
+        await self.until_delay(random.uniform(50, 150)/1000)
 
     async def until_delay(self, d):
-        deadline = self.state.time() + d
-        while self.state.time() < deadline:
-            await self.next_tick()
+        # Delays are in sim time, which stands still while the game is
+        # paused: sleep for the remainder, waiting out pauses as needed.
+        time_ = self.state.time
+        deadline = time_() + d
+        while True:
+            remaining = deadline - time_()
+            if remaining <= 0:
+                return
+            if self.state.pause_time is not None:
+                await self.state.unpaused.wait()
+            else:
+                await asyncio.sleep(remaining)
 
     async def until_ability_starts(self, name):
         self.state.gc_abilities()
-        while True:
-            for abi in self.state.abilities.values():
-                if abi.name == name:
-                    return
-            await self.next_tick()
+        evt = self.state.ability_event(name)
+        while not self.state.abilities_by_name.get(name):
+            evt.clear()
+            await evt.wait()
 
     async def until_ability_triggers(self, name):
         self.state.gc_abilities()
+        evt = self.state.ability_event(name)
+        time_ = self.state.time
         while True:
-            for abi in self.state.abilities.values():
-                if abi.name == name and abi.cast_deadline < self.state.time():
-                    return
-            await self.next_tick()
+            abis = self.state.abilities_by_name.get(name)
+            if not abis:
+                evt.clear()
+                await evt.wait()
+                continue
+            deadline = min(abi.cast_deadline for abi in abis)
+            remaining = deadline - time_()
+            if remaining <= 0:
+                return
+            # Still casting: wait for the cast to finish, or for a new cast
+            # with the same name which might finish earlier.
+            evt.clear()
+            if self.state.pause_time is not None:
+                await self.state.unpaused.wait()
+                continue
+            try:
+                await asyncio.wait_for(evt.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
 
 
 class WyrmholeStrategy(BaseAiStrategy):
@@ -154,19 +180,18 @@ class WyrmholeStrategy(BaseAiStrategy):
         rng.shuffle(pids)
 
     async def gnash_lash(self, out_first):
-        x, y = norm(self.me.x, self.me.y)
-        x *= self.NIDSTINIEN_SIZE
-        y *= self.NIDSTINIEN_SIZE
+        loc = scale(norm(self.me.x, self.me.y), self.NIDSTINIEN_SIZE)
+        out_loc, in_loc = scale(loc, 1.2), scale(loc, 0.9)
 
         if out_first:
-            await self.go_to(x * 1.2, y * 1.2)
+            await self.go_to(*out_loc)
             await self.until_ability_triggers('Gnash')
-            await self.go_to(x * 0.9, y * 0.9)
+            await self.go_to(*in_loc)
             await self.until_ability_triggers('Lash')
         else:
-            await self.go_to(x * 0.9, y * 0.9)
+            await self.go_to(*in_loc)
             await self.until_ability_triggers('Lash')
-            await self.go_to(x * 1.2, y * 1.2)
+            await self.go_to(*out_loc)
             await self.until_ability_triggers('Gnash')
 
     async def mainloop(self):
@@ -176,24 +201,17 @@ class WyrmholeStrategy(BaseAiStrategy):
         JUMP_CIRCLE = 12
         JUMP_FRONT = 13
         JUMP_BACK = 14
+        GROUPS = frozenset({GROUP_1, GROUP_2, GROUP_3})
+        JUMPS = frozenset({JUMP_CIRCLE, JUMP_FRONT, JUMP_BACK})
 
         nid = await self.until_enemy_spawn('Nidstinein')
+        nid_x, nid_y = self.enemy(nid).x, self.enemy(nid).y
         nid_angle = self.enemy(nid).angle
-        nid_front = (
-            self.enemy(nid).x + xcircle(self.NIDSTINIEN_SIZE, nid_angle),
-            self.enemy(nid).y + ycircle(self.NIDSTINIEN_SIZE, nid_angle),
-        )
-        nid_back = (
-            self.enemy(nid).x + xcircle(self.NIDSTINIEN_SIZE, -nid_angle),
-            self.enemy(nid).y + ycircle(self.NIDSTINIEN_SIZE, -nid_angle),
-        )
-        nid_left = (
-            self.enemy(nid).x + xcircle(self.NIDSTINIEN_SIZE, nid_angle+math.pi/2),
-            self.enemy(nid).y + ycircle(self.NIDSTINIEN_SIZE, nid_angle+math.pi/2),
-        )
-        nid_right = (
-            self.enemy(nid).x + xcircle(self.NIDSTINIEN_SIZE, nid_angle-math.pi/2),
-            self.enemy(nid).y + ycircle(self.NIDSTINIEN_SIZE, nid_angle-math.pi/2),
+        nid_front, nid_back, nid_left, nid_right = (
+            (nid_x + xcircle(self.NIDSTINIEN_SIZE, a),
+             nid_y + ycircle(self.NIDSTINIEN_SIZE, a))
+            for a in (nid_angle, -nid_angle,
+                      nid_angle + math.pi/2, nid_angle - math.pi/2)
         )
         face_angle = math.atan2(nid_left[1], nid_left[0])
 
@@ -205,7 +223,7 @@ class WyrmholeStrategy(BaseAiStrategy):
 
         await self.go_to(*nid_front)
         
-        await self.until_buff_distributed(self.me, {GROUP_1, GROUP_2, GROUP_3})
+        await self.until_buff_distributed(self.me, GROUPS)
         await self.until_delay(0.5)
         if self.me.has_buff(GROUP_1):
             # Prespread in case 1 has no arrows.
@@ -214,7 +232,7 @@ class WyrmholeStrategy(BaseAiStrategy):
             self.consistent_shuffle(g1_pids)
             loc1 = spread13_locs[g1_pids.index(self.me.id)]
             await self.go_to(loc1[0] / 3, loc1[1] / 3)  # Pre-move.
-            await self.until_buff_distributed(self.me, {JUMP_CIRCLE, JUMP_FRONT, JUMP_BACK})
+            await self.until_buff_distributed(self.me, JUMPS)
 
             arrows = any(not p.has_buff(JUMP_CIRCLE)
                          for p in self.state.players.values()
@@ -234,7 +252,7 @@ class WyrmholeStrategy(BaseAiStrategy):
             out_first = self.is_ability_casting('Gnash and Lash')
 
             await self.until_buff_gone(self.me, GROUP_1)
-            await self.go_to(nid_front[0] * 0.9, nid_front[1] * 0.9)
+            await self.go_to(*scale(nid_front, 0.9))
             await self.gnash_lash(out_first)
             await self.go_to(nid_front[0], nid_front[1])
 
@@ -252,7 +270,7 @@ class WyrmholeStrategy(BaseAiStrategy):
 
             await self.until_ability_triggers('Dark High Jump')
             if loc1 == spread13_locs[0]:
-                await self.go_to(nid_back[0] * 0.9, nid_back[1] * 0.9)
+                await self.go_to(*scale(nid_back, 0.9))
             await self.gnash_lash(out_first)
             await self.until_ability_triggers('Tower explosion')
             if loc1 == spread13_locs[0]:
@@ -264,7 +282,7 @@ class WyrmholeStrategy(BaseAiStrategy):
             g2_pids = [p.id for p in self.state.players.values()
                             if p.has_buff(GROUP_2)]
             self.consistent_shuffle(g2_pids)
-            await self.until_buff_distributed(self.me, {JUMP_CIRCLE, JUMP_FRONT, JUMP_BACK})
+            await self.until_buff_distributed(self.me, JUMPS)
             await self.until_delay(1.5)
 
             arrows = any(not p.has_buff(JUMP_CIRCLE)
@@ -310,7 +328,7 @@ class WyrmholeStrategy(BaseAiStrategy):
             g3_pids = [p.id for p in self.state.players.values()
                             if p.has_buff(GROUP_3)]
             self.consistent_shuffle(g3_pids)
-            await self.until_buff_distributed(self.me, {JUMP_CIRCLE, JUMP_FRONT, JUMP_BACK})
+            await self.until_buff_distributed(self.me, JUMPS)
             await self.until_delay(0.5)
 
             arrows = any(not p.has_buff(JUMP_CIRCLE)
@@ -332,12 +350,12 @@ class WyrmholeStrategy(BaseAiStrategy):
             await self.until_delay(2.0)
             out_first = self.is_ability_casting('Gnash and Lash')
             await self.until_ability_triggers('Dark High Jump')
-            await self.go_to(my_loc[0] * 0.9, my_loc[1] * 0.9)
+            await self.go_to(*scale(my_loc, 0.9))
             await self.gnash_lash(out_first)
             await self.until_ability_triggers('Tower explosion')
-            await self.go_to(my_loc[0] * 1.2, my_loc[1] * 1.2)
+            await self.go_to(*scale(my_loc, 1.2))
             await self.until_ability_starts('Geirskogul')
-            await self.go_to(my_loc[0] * 0.8, my_loc[1] * 0.8)
+            await self.go_to(*scale(my_loc, 0.8))
             await self.until_ability_triggers('Geirskogul')
             await self.go_to(my_loc[0], my_loc[1])
             self.face(face_angle)
@@ -345,7 +363,7 @@ class WyrmholeStrategy(BaseAiStrategy):
             await self.until_delay(5.0)
             out_first = self.is_ability_casting('Gnash and Lash')
             await self.until_ability_triggers('Dark High Jump')
-            await self.go_to(nid_front[0] * 0.9, nid_front[1] * 0.9)
+            await self.go_to(*scale(nid_front, 0.9))
             await self.gnash_lash(out_first)
             await self.go_to(nid_front[0], nid_front[1])
 
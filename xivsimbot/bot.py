@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import Mapping
+from typing import Dict, Set
 
 import asyncio
 import logging
@@ -21,12 +21,6 @@ class Enemy:
     angle: float
 
 
-@dataclass
-class Buff:
-    id: int
-    deadline: int
-
-
 @dataclass
 class Player:
     id: int
@@ -35,18 +29,32 @@ class Player:
     y: int = 0
     angle: float = 0
     moving: bool = False
-    buffs: Mapping[int, Buff] = field(default_factory=dict)
+    buffs: Set[int] = field(default_factory=set)
+    buff_deadlines: Dict[int, float] = field(default_factory=dict)
+    # Set whenever the position/orientation changes and needs to be sent.
+    dirty: asyncio.Event = field(default_factory=asyncio.Event,
+                                 repr=False, compare=False)
+    # Set whenever the buffs change.
+    buff_changed: asyncio.Event = field(default_factory=asyncio.Event,
+                                        repr=False, compare=False)
 
     def reset(self):
         self.x = self.y = self.angle = 0
         self.moving = False
-        self.buffs = {}
+        self.buffs = set()
+        self.buff_deadlines = {}
+        self.dirty.set()
+        self.buff_changed.set()
 
     def add_buff(self, id, deadline):
-        self.buffs[id] = Buff(id=id, deadline=deadline)
+        self.buffs.add(id)
+        self.buff_deadlines[id] = deadline
+        self.buff_changed.set()
 
     def remove_buff(self, id):
-        del self.buffs[id]
+        self.buffs.discard(id)
+        self.buff_deadlines.pop(id, None)
+        self.buff_changed.set()
 
     def has_buff(self, id):
         return id in self.buffs
@@ -62,24 +70,34 @@ class Ability:
 class SimState:
     def __init__(self):
         self.players = {}
+        self.own_pid = None
         self.enemies = {}
+        self.enemies_by_name = {}
+        self.enemy_events = {}  # Lazily created, see enemy_event.
         self.abilities = {}
+        self.abilities_by_name = {}
+        self.ability_events = {}  # Lazily created, see ability_event.
 
         self.pause_time = None
+        self.unpaused = asyncio.Event()  # Cleared while the game is paused.
+        self.unpaused.set()
         self.server_offset = 0  # TODO?
         self.pause_offset = 0
 
     def reset(self):
         self.enemies = {}
+        self.enemies_by_name = {}
         for p in self.players.values():
             p.reset()
 
     def pause(self):
         self.pause_time = self.time()
+        self.unpaused.clear()
 
     def unpause(self, offset):
         self.pause_time = None
         self.pause_offset = offset
+        self.unpaused.set()
 
     def time(self):
         if self.pause_time is not None:
@@ -94,32 +112,70 @@ class SimState:
             return
         p = self.players[pid]
         p.x, p.y, p.angle, p.moving = int(x), int(y), angle, moving
+        if pid == self.own_pid:
+            p.dirty.set()
 
     def remove_player(self, pid):
         if pid not in self.players:
             return
-        del self.players[pid]
+        p = self.players.pop(pid)
+        p.dirty.set()  # Wake up any update loop so it can exit.
 
     def add_enemy(self, eid, name, x, y, angle):
-        self.enemies[eid] = Enemy(id=eid, name=name, x=x, y=y, angle=angle)
+        self.remove_enemy(eid)
+        enemy = Enemy(id=eid, name=name, x=x, y=y, angle=angle)
+        self.enemies[eid] = enemy
+        self.enemies_by_name.setdefault(name, []).append(enemy)
+        if name in self.enemy_events:
+            self.enemy_events[name].set()
+
+    def enemy_event(self, name):
+        '''Returns an event set whenever an enemy with this name spawns.'''
+        if name not in self.enemy_events:
+            self.enemy_events[name] = asyncio.Event()
+        return self.enemy_events[name]
 
     def remove_enemy(self, eid):
         if eid not in self.enemies:
             return
-        del self.enemies[eid]
+        enemy = self.enemies.pop(eid)
+        same_name = self.enemies_by_name[enemy.name]
+        same_name.remove(enemy)
+        if not same_name:
+            del self.enemies_by_name[enemy.name]
 
     def add_ability(self, aid, name, duration):
-        self.abilities[aid] = Ability(
-                id=aid, name=name, cast_deadline=self.time()+duration,
-                gc_deadline=self.time()+duration+1)
+        self.remove_ability(aid)
+        t = self.time()
+        abi = Ability(
+                id=aid, name=name, cast_deadline=t+duration,
+                gc_deadline=t+duration+1)
+        self.abilities[aid] = abi
+        self.abilities_by_name.setdefault(name, []).append(abi)
+        if name in self.ability_events:
+            self.ability_events[name].set()
+
+    def ability_event(self, name):
+        '''Returns an event set whenever an ability with this name starts.'''
+        if name not in self.ability_events:
+            self.ability_events[name] = asyncio.Event()
+        return self.ability_events[name]
 
     def gc_abilities(self):
-        to_remove = set()
-        for abi in self.abilities.values():
-            if self.time() > abi.gc_deadline:
-                to_remove.add(abi.id)
+        t = self.time()
+        to_remove = [aid for aid, abi in self.abilities.items()
+                     if t > abi.gc_deadline]
         for aid in to_remove:
-            del self.abilities[aid]
+            self.remove_ability(aid)
+
+    def remove_ability(self, aid):
+        if aid not in self.abilities:
+            return
+        abi = self.abilities.pop(aid)
+        same_name = self.abilities_by_name[abi.name]
+        same_name.remove(abi)
+        if not same_name:
+            del self.abilities_by_name[abi.name]
 
 
 class XivSimClient:
@@ -139,24 +195,39 @@ class XivSimClient:
 
     def continuous_player_update(self, gclient):
         async def func():
+            last = None
+            prefix = f'0|{self.pid}|'
+            # Cache the facing vector, it's sent way more often than it
+            # changes.
+            last_angle = fx = fy = None
+            if self.pid in self.state.players:
+                self.state.players[self.pid].dirty.set()  # Initial update.
             while True:
-                await asyncio.sleep(0.05)
                 if self.pid not in self.state.players:
                     return
                 me = self.state.players[self.pid]
-                fields = (
-                    0,
-                    self.pid,
-                    int(me.x),
-                    int(me.y),
-                    int(10000 * math.cos(me.angle)),
-                    int(10000 * math.sin(me.angle)),
-                    int(me.moving),
-                    0,
-                    0,
-                )
-                s = '|'.join(str(f) for f in fields)
-                gclient.send('_rawstr', s)
+                try:
+                    await asyncio.wait_for(me.dirty.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    # Heartbeat: packets can get lost, and new players need
+                    # to learn our position too.
+                    if last is not None:
+                        gclient.send('_rawstr', last)
+                    continue
+                me.dirty.clear()
+                if self.pid not in self.state.players:
+                    return
+                if me.angle != last_angle:
+                    last_angle = me.angle
+                    fx = int(10000 * math.cos(me.angle))
+                    fy = int(10000 * math.sin(me.angle))
+                s = (f'{prefix}{int(me.x)}|{int(me.y)}|{fx}|{fy}|'
+                     f'{int(me.moving)}|0|0')
+                if s != last:
+                    gclient.send('_rawstr', s)
+                    last = s
+                # Rate limit, further changes get coalesced into one update.
+                await asyncio.sleep(0.05)
         asyncio.create_task(func())
 
     async def mainloop(self):
@@ -172,6 +243,7 @@ class XivSimClient:
                             self.current_map)
             elif evt.type == 'setId':
                 self.pid = evt.payload['id']
+                self.state.own_pid = self.pid
                 logger.info('Received ID, I am %d', self.pid)
                 self.state.add_player(self.pid, 'hi')
                 for p in evt.payload['players']:
@@ -234,11 +306,12 @@ class XivSimClient:
             elif evt.type == '_rawstr':
                 fields = evt.payload.split('|')
                 if fields[0] == '0':  # player update
-                    pid, x, y, fx, fy, m, _, _ = [int(f) for f in fields[1:]]
+                    _, pid, x, y, fx, fy, m, _, _ = fields
+                    pid = int(pid)
                     if pid == self.pid:
                         continue
-                    angle = math.atan2(fy, fx)
-                    self.state.update_player(pid, x, y, angle, m)
+                    angle = math.atan2(int(fy), int(fx))
+                    self.state.update_player(pid, int(x), int(y), angle, int(m))
             else:
                 pass
 
@@ -249,11 +322,6 @@ class XivSimClient:
 
 
 
-def spawn(server, port, password):
-    asyncio.create_task(XivSimClient(server, port, password).mainloop())
-    asyncio.create_task(XivSimClient(server, port, password).mainloop())
-    asyncio.create_task(XivSimClient(server, port, password).mainloop())
-    asyncio.create_task(XivSimClient(server, port, password).mainloop())
-    asyncio.create_task(XivSimClient(server, port, password).mainloop())
-    asyncio.create_task(XivSimClient(server, port, password).mainloop())
-    asyncio.create_task(XivSimClient(server, port, password).mainloop())
+def spawn(server, port, password, n=7):
+    for _ in range(n):
+        asyncio.create_task(XivSimClient(server, port, password).mainloop())
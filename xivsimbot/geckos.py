@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import Any
 
@@ -8,40 +9,68 @@ import json
 import logging
 import random
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+RELIABLE_SEEN_MAX = 4096  # Reliable message IDs remembered for dedup.
+
+_RELIABLE_ID_CHARSET = (
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789')
+
+# orjson is much faster on the hot data path, but optional. Its decode errors
+# subclass json.JSONDecodeError, so callers only need to handle the latter.
+if orjson is not None:
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj):
+        # Geckos expects text messages, not binary ones.
+        return orjson.dumps(obj).decode()
+else:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
 
 class GeckosSignaling:
     '''Signaling client for geckos.io RTC data channel establishment.'''
 
     def __init__(self, server, port):
         self.baseurl = f'{server}:{port}/.wrtc/v2'
+        self._session = None
+
+    def _get_session(self):
+        # Shared across all signaling requests so the connection is reused.
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=32, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
 
     async def request_offer(self):
         url = f'{self.baseurl}/connections'
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json={}) as resp:
-                assert resp.status == 200
-                data = await resp.json()
-                rdp = aiortc.RTCSessionDescription(
-                    type=data['localDescription']['type'],
-                    sdp=data['localDescription']['sdp'],
-                )
-                assert rdp.type == 'offer'
-                return data['id'], rdp
+        async with self._get_session().post(url, json={}) as resp:
+            assert resp.status == 200
+            data = await resp.json()
+            rdp = aiortc.RTCSessionDescription(
+                type=data['localDescription']['type'],
+                sdp=data['localDescription']['sdp'],
+            )
+            assert rdp.type == 'offer'
+            return data['id'], rdp
 
     async def request_ice_candidates(self, uid):
         url = f'{self.baseurl}/connections/{uid}/additional-candidates'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                assert resp.status == 200
-                candidates = await resp.json()
-                for data in candidates:
-                    magic, candidate_str = data['candidate'].split(':', 1)
-                    assert magic == 'a=candidate'
-                    candidate = aiortc.sdp.candidate_from_sdp(candidate_str)
-                    candidate.sdpMid = data['sdpMid']
-                    yield candidate
+        async with self._get_session().get(url) as resp:
+            assert resp.status == 200
+            candidates = await resp.json()
+            for data in candidates:
+                magic, candidate_str = data['candidate'].split(':', 1)
+                assert magic == 'a=candidate'
+                candidate = aiortc.sdp.candidate_from_sdp(candidate_str)
+                candidate.sdpMid = data['sdpMid']
+                yield candidate
 
     async def send_answer(self, uid, ldp):
         url = f'{self.baseurl}/connections/{uid}/remote-description'
@@ -49,9 +78,13 @@ class GeckosSignaling:
             'type': ldp.type,
             'sdp': ldp.sdp,
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data) as resp:
-                assert resp.status == 200
+        async with self._get_session().post(url, json=data) as resp:
+            assert resp.status == 200
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
 
 
 @dataclass
@@ -75,7 +108,7 @@ class GeckosClient:
         self.port = port
         self.channel = None
         self.readq = asyncio.Queue(maxsize=65536)  # for safety
-        self.reliable_seen = set()
+        self.reliable_seen = OrderedDict()  # Used as a bounded LRU set.
 
     async def connect(self):
         pc = aiortc.RTCPeerConnection()
@@ -96,27 +129,27 @@ class GeckosClient:
 
             chanq.put_nowait(channel)
 
-        uid, rdp = await signaling.request_offer()
-        await pc.setRemoteDescription(rdp)
-        await pc.setLocalDescription(await pc.createAnswer())
-        await signaling.send_answer(uid, pc.localDescription)
-        async for candidate in signaling.request_ice_candidates(uid):
-            await pc.addIceCandidate(candidate)
+        try:
+            uid, rdp = await signaling.request_offer()
+            await pc.setRemoteDescription(rdp)
+            await pc.setLocalDescription(await pc.createAnswer())
+            await signaling.send_answer(uid, pc.localDescription)
+            async for candidate in signaling.request_ice_candidates(uid):
+                await pc.addIceCandidate(candidate)
+        finally:
+            await signaling.close()
         self.channel = await chanq.get()
 
     def send(self, type, payload):
         if type == '_rawstr':
             self.channel.send(payload)
         else:
-            self.channel.send(json.dumps({type: payload}))
+            self.channel.send(_json_dumps({type: payload}))
 
     def send_reliable(self, type, payload):
         # TODO: Retransmit regularly, if we even need it?
-        charset = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
-        id = ''
-        for i in range(24):
-            id += random.choice(charset)
-        self.channel.send(json.dumps({
+        id = ''.join(random.choices(_RELIABLE_ID_CHARSET, k=24))
+        self.channel.send(_json_dumps({
             type: {
                 'MESSAGE': payload,
                 'RELIABLE': 1,
@@ -134,19 +167,22 @@ class GeckosClient:
             # a raw string or a typed json event. The JS implementation of
             # Geckos always tries to pass the data through a JSON decoder,
             # instead we slightly optimize by checking for JSON structure.
-            likely_json = any(c in packet for c in '{}[]')
+            # Geckos events are always serialized objects/arrays, so looking
+            # at the first character is enough. Packets can be str or bytes.
+            likely_json = packet[:1] in ('{', '[', b'{', b'[')
             if likely_json:
                 try:
-                    packet = json.loads(packet)
+                    packet = _json_loads(packet)
 
-                    type = list(packet.keys())[0]
-                    payload = list(packet.values())[0]
+                    type, payload = next(iter(packet.items()))
                     if isinstance(payload, dict) and 'RELIABLE' in payload:
                         # Only emit the first time we've seen the event.
-                        # TODO: leaking memory, should have an expiry.
                         if payload['ID'] in self.reliable_seen:
+                            self.reliable_seen.move_to_end(payload['ID'])
                             continue
-                        self.reliable_seen.add(payload['ID'])
+                        self.reliable_seen[payload['ID']] = None
+                        if len(self.reliable_seen) > RELIABLE_SEEN_MAX:
+                            self.reliable_seen.popitem(last=False)
                         payload = payload['MESSAGE']
 
                     yield Event(type=type, payload=payload)
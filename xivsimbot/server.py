@@ -1,14 +1,17 @@
 from aiohttp import web
 from . import bot
 
-import logging
-
+from concurrent.futures import ThreadPoolExecutor
 
-INDEX_HTML = open('index.html', 'rb').read()
+import asyncio
+import logging
+import os
+import sys
 
 
 async def handle_index(request):
-    return web.Response(content_type='text/html', body=INDEX_HTML)
+    return web.FileResponse('index.html',
+                            headers={'Content-Type': 'text/html'})
 
 async def handle_start_request(request):
     params = await request.post()
@@ -22,7 +25,16 @@ async def handle_start_request(request):
     return web.Response(text=f'Bots are on their way!')
 
 
+async def setup_executor(app):
+    # Bound the default executor, many bots offloading work to threads at the
+    # same time shouldn't explode the thread count.
+    workers = min(32, (os.cpu_count() or 1) * 2)
+    asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=workers))
+
+
 app = web.Application()
+app.on_startup.append(setup_executor)
 app.add_routes([
     web.get('/', handle_index),
     web.post('/start', handle_start_request),
@@ -31,4 +43,9 @@ app.add_routes([
 if __name__ == '__main__':
     logging.basicConfig()
     logging.getLogger().setLevel(logging.INFO)
+    if sys.platform != 'win32':
+        # libuv-based loop: much lower per-callback overhead for the many
+        # concurrent bot tick loops.
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
     web.run_app(app, port=6565)